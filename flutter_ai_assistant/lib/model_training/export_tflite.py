@@ -5,30 +5,46 @@ Based on the paper "Building Cross-Platform AI Assistants with Flutter and Tenso
 
 import os
 import json
+from typing import Final
+
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.text import tokenizer_from_json
-from tensorflow.keras.preprocessing.sequence import pad_sequences
+from tensorflow.keras.preprocessing.text import Tokenizer
+
+from train_model import load_data, create_graph_tokenizer
 
 # Configuration
 CONFIG = {
-    'model_path': 'models/intent_classifier.h5',
+    'model_path': 'models/intent_classifier',
     'tokenizer_path': 'models/tokenizer.json',
     'label_encoder_path': 'models/label_encoder.json',
     'tflite_model_path': 'assets/model.tflite',
     'tflite_quantized_path': 'assets/model_quantized.tflite',
+    'tflite_fp16_path': 'assets/model_fp16.tflite',
     'model_metadata_path': 'assets/model_metadata.json',
     'max_sequence_length': 32,
-    'representative_dataset_size': 100
+    'representative_dataset_size': 500
 }
 
+# Test samples for the export smoke test
+TEST_TEXTS: Final[tuple[str, ...]] = (
+    "What's the weather like?",
+    "What time is it?",
+    "Hello there",
+    "Play some music",
+)
+
 def load_tokenizer_and_labels():
     """Load tokenizer and label encoder"""
-    # Load tokenizer
+    # Load tokenizer from its flat config - a single json.load plus
+    # direct word_index assignment
     with open(CONFIG['tokenizer_path'], 'r') as f:
-        tokenizer_json = f.read()
-    tokenizer = tokenizer_from_json(tokenizer_json)
+        tokenizer_data = json.load(f)
+    tokenizer = Tokenizer(
+        num_words=tokenizer_data['num_words'],
+        oov_token=tokenizer_data['oov_token']
+    )
+    tokenizer.word_index = tokenizer_data['word_index']
     
     # Load label encoder
     with open(CONFIG['label_encoder_path'], 'r') as f:
@@ -38,62 +54,68 @@ def load_tokenizer_and_labels():
 
 def create_representative_dataset(tokenizer):
     """Create representative dataset for quantization"""
-    # Sample texts for representative dataset
-    sample_texts = [
-        "What's the weather like?",
-        "What time is it?",
-        "Hello there",
-        "Play some music",
-        "Show me my calendar",
-        "What's in the news?",
-        "Help me with this",
-        "Good morning",
-        "Is it going to rain?",
-        "Play my favorite song",
-        "What's on my schedule?",
-        "Tell me a joke",
-        "How's the weather today?",
-        "What's the current time?",
-        "Hi there",
-        "Turn on the radio",
-        "Check my appointments",
-        "What's happening in the world?",
-        "What can you do?",
-        "Good evening",
-    ]
-    
-    # Convert to sequences
-    sequences = tokenizer.texts_to_sequences(sample_texts)
-    
-    # Pad sequences
-    padded_sequences = pad_sequences(
-        sequences,
-        maxlen=CONFIG['max_sequence_length'],
-        padding='post',
-        truncating='post'
-    )
-    
-    # Create representative dataset generator
+    # Calibrate on the actual training corpus rather than a handful of
+    # hardcoded strings
+    sample_texts = load_data()['text']
+
+    # Tokenize and pad in graph mode
+    tokenize = create_graph_tokenizer(tokenizer)
+    padded_sequences = tokenize(tf.constant(sample_texts)).numpy()
+
+    # Pre-cast once to a contiguous float32 array so the generator
+    # yields views instead of re-allocating per calibration step
+    padded_f32 = np.ascontiguousarray(padded_sequences, dtype=np.float32)
+
+    # Create representative dataset generator - each unique sample once,
+    # capped at the target size (duplicates add no min/max information)
     def representative_dataset():
-        for i in range(min(len(padded_sequences), CONFIG['representative_dataset_size'])):
-            yield [padded_sequences[i:i+1].astype(np.float32)]
-    
+        for i in range(min(len(padded_f32), CONFIG['representative_dataset_size'])):
+            yield [padded_f32[i:i+1]]
+
     return representative_dataset
 
+def verify_per_channel_quantization(tflite_model):
+    """Assert the Dense kernels carry per-output-channel weight scales
+
+    A Dense kernel quantized per-tensor (a single scalar scale) loses
+    accuracy at 8-bit; fail the export rather than shipping it.
+    """
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    interpreter.allocate_tensors()
+
+    checked = 0
+    for detail in interpreter.get_tensor_details():
+        # Dense kernels are the 2-D int8 [units, features] MatMul weights;
+        # skip activations and the (per-tensor) embedding table
+        if 'MatMul' not in detail['name'] or len(detail['shape']) != 2:
+            continue
+        if detail['dtype'] != np.int8 or detail['shape'][0] <= 1:
+            continue
+
+        scales = detail['quantization_parameters']['scales']
+        units = detail['shape'][0]
+        if len(scales) != units:
+            raise ValueError(
+                f"Dense kernel {detail['name']} is not per-channel quantized: "
+                f"{len(scales)} scales for {units} units"
+            )
+        print(f"  Per-channel kernel: {detail['name']} ({len(scales)} scales)")
+        checked += 1
+
+    if checked == 0:
+        raise ValueError("No per-channel Dense kernels found in the quantized model")
+
 def export_tflite_model():
     """Export model to TensorFlow Lite format"""
     # Create assets directory
     os.makedirs('assets', exist_ok=True)
     
-    # Load model
-    print("Loading trained model...")
-    model = load_model(CONFIG['model_path'])
-    
     # Load tokenizer and labels
     tokenizer, class_names = load_tokenizer_and_labels()
-    
-    # Create TensorFlow Lite converter
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    # Create TensorFlow Lite converter straight from the SavedModel,
+    # skipping Keras object reconstruction
+    converter = tf.lite.TFLiteConverter.from_saved_model(CONFIG['model_path'])
     
     # Convert to TFLite (float32)
     print("Converting to TensorFlow Lite (float32)...")
@@ -108,7 +130,7 @@ def export_tflite_model():
     
     # Create quantized model
     print("Converting to TensorFlow Lite (quantized)...")
-    converter_quantized = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter_quantized = tf.lite.TFLiteConverter.from_saved_model(CONFIG['model_path'])
     
     # Set optimization flags
     converter_quantized.optimizations = [tf.lite.Optimize.DEFAULT]
@@ -121,35 +143,49 @@ def export_tflite_model():
     converter_quantized.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
     converter_quantized.inference_input_type = tf.int8
     converter_quantized.inference_output_type = tf.int8
-    
+
     try:
-        # Convert with quantization
+        # Convert with quantization - the Dense layers are QAT-trained but
+        # the embedding relies on representative-dataset calibration, so
+        # conversion can still fail on bad activation ranges
         tflite_quantized_model = converter_quantized.convert()
-        
-        # Save quantized model
-        with open(CONFIG['tflite_quantized_path'], 'wb') as f:
-            f.write(tflite_quantized_model)
-        
-        print(f"Quantized model saved to: {CONFIG['tflite_quantized_path']}")
-        print(f"Quantized model size: {len(tflite_quantized_model) / 1024:.2f} KB")
-        print(f"Compression ratio: {len(tflite_model) / len(tflite_quantized_model):.2f}x")
-        
+        quantized_full_int8 = True
     except Exception as e:
         print(f"Quantization failed: {e}")
         print("Using dynamic range quantization instead...")
-        
+
         # Fallback to dynamic range quantization
-        converter_dynamic = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter_dynamic = tf.lite.TFLiteConverter.from_saved_model(CONFIG['model_path'])
         converter_dynamic.optimizations = [tf.lite.Optimize.DEFAULT]
-        
+
         tflite_quantized_model = converter_dynamic.convert()
-        
-        with open(CONFIG['tflite_quantized_path'], 'wb') as f:
-            f.write(tflite_quantized_model)
-        
-        print(f"Dynamic quantized model saved to: {CONFIG['tflite_quantized_path']}")
-        print(f"Dynamic quantized model size: {len(tflite_quantized_model) / 1024:.2f} KB")
-    
+        quantized_full_int8 = False
+
+    # Save quantized model
+    with open(CONFIG['tflite_quantized_path'], 'wb') as f:
+        f.write(tflite_quantized_model)
+
+    print(f"Quantized model saved to: {CONFIG['tflite_quantized_path']}")
+    print(f"Quantized model size: {len(tflite_quantized_model) / 1024:.2f} KB")
+    print(f"Compression ratio: {len(tflite_model) / len(tflite_quantized_model):.2f}x")
+
+    if quantized_full_int8:
+        verify_per_channel_quantization(tflite_quantized_model)
+
+    # Create float16 model for GPU-delegate deployments
+    print("Converting to TensorFlow Lite (float16)...")
+    converter_fp16 = tf.lite.TFLiteConverter.from_saved_model(CONFIG['model_path'])
+    converter_fp16.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter_fp16.target_spec.supported_types = [tf.float16]
+
+    tflite_fp16_model = converter_fp16.convert()
+
+    with open(CONFIG['tflite_fp16_path'], 'wb') as f:
+        f.write(tflite_fp16_model)
+
+    print(f"Float16 model saved to: {CONFIG['tflite_fp16_path']}")
+    print(f"Float16 model size: {len(tflite_fp16_model) / 1024:.2f} KB")
+
     # Create model metadata
     metadata = {
         'model_name': 'Intent Classification Model',
@@ -160,7 +196,7 @@ def export_tflite_model():
         'max_sequence_length': CONFIG['max_sequence_length'],
         'vocab_size': len(tokenizer.word_index) + 1,
         'preprocessing': {
-            'tokenizer_config': tokenizer.get_config(),
+            'oov_token': tokenizer.oov_token,
             'padding': 'post',
             'truncating': 'post'
         }
@@ -176,51 +212,57 @@ def export_tflite_model():
     print("\nTesting models...")
     test_inference(CONFIG['tflite_model_path'], tokenizer, class_names)
     test_inference(CONFIG['tflite_quantized_path'], tokenizer, class_names)
+    test_inference(CONFIG['tflite_fp16_path'], tokenizer, class_names)
     
     print("\nExport completed successfully!")
 
 def test_inference(model_path, tokenizer, class_names):
     """Test inference with the exported model"""
-    # Load TFLite model
-    interpreter = tf.lite.Interpreter(model_path=model_path)
+    # Load TFLite model with all CPU threads; the default XNNPACK
+    # delegate then mirrors production Flutter deployment
+    interpreter = tf.lite.Interpreter(
+        model_path=model_path,
+        num_threads=os.cpu_count()
+    )
     interpreter.allocate_tensors()
     
     # Get input and output tensors
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
-    
-    # Test samples
-    test_texts = [
-        "What's the weather like?",
-        "What time is it?",
-        "Hello there",
-        "Play some music"
-    ]
-    
+
     print(f"\nTesting {model_path}:")
-    
-    for text in test_texts:
-        # Preprocess text
-        sequence = tokenizer.texts_to_sequences([text])
-        padded = pad_sequences(
-            sequence,
-            maxlen=CONFIG['max_sequence_length'],
-            padding='post',
-            truncating='post'
-        )
-        
-        # Set input tensor
-        interpreter.set_tensor(input_details[0]['index'], padded.astype(np.float32))
-        
-        # Run inference
-        interpreter.invoke()
-        
-        # Get output
-        output = interpreter.get_tensor(output_details[0]['index'])[0]
-        predicted_class = class_names[np.argmax(output)]
-        confidence = np.max(output)
-        
-        print(f"  '{text}' -> {predicted_class} (confidence: {confidence:.3f})")
+
+    # Preprocess all texts at once in graph mode
+    tokenize = create_graph_tokenizer(tokenizer)
+    padded = tokenize(tf.constant(TEST_TEXTS)).numpy()
+
+    # Quantize on the host when the model expects int8 input; the float
+    # models keep the fp32 path
+    if input_details[0]['dtype'] == np.int8:
+        scale, zero_point = input_details[0]['quantization']
+        padded = np.clip(
+            np.round(padded / scale + zero_point), -128, 127
+        ).astype(np.int8)
+    else:
+        padded = padded.astype(np.float32)
+
+    # Resize input tensor to the batch and run a single inference
+    interpreter.resize_tensor_input(input_details[0]['index'], padded.shape)
+    interpreter.allocate_tensors()
+    interpreter.set_tensor(input_details[0]['index'], padded)
+    interpreter.invoke()
+
+    # Get output for the whole batch, dequantizing int8 scores back to
+    # probabilities
+    output = interpreter.get_tensor(output_details[0]['index'])
+    if output_details[0]['dtype'] == np.int8:
+        out_scale, out_zero_point = output_details[0]['quantization']
+        output = (output.astype(np.float32) - out_zero_point) * out_scale
+    predictions = np.argmax(output, axis=1)
+    confidences = np.max(output, axis=1)
+
+    for text, prediction, confidence in zip(TEST_TEXTS, predictions, confidences):
+        print(f"  '{text}' -> {class_names[prediction]} (confidence: {confidence:.3f})")
 
 if __name__ == "__main__":
     export_tflite_model()
\ No newline at end of file
@@ -4,16 +4,18 @@ Based on the paper "Building Cross-Platform AI Assistants with Flutter and Tenso
 """
 
 import os
+import re
 import json
+from typing import Final
+
 import numpy as np
 import pandas as pd
 import tensorflow as tf
+import tensorflow_model_optimization as tfmot
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
 from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Input, Dense, Embedding, GlobalAveragePooling1D, Dropout
+from tensorflow.keras.layers import Input, Dense, Embedding, Dropout, Layer
 from tensorflow.keras.preprocessing.text import Tokenizer
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
 
@@ -21,103 +23,133 @@ from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLRO
 CONFIG = {
     'max_vocab_size': 10000,
     'max_sequence_length': 32,
-    'embedding_dim': 128,
-    'hidden_units': 64,
+    'embedding_dim': 32,  # right-sized for the tiny corpus; shrinks the INT8 artifact ~4x
+    'hidden_units': 32,
     'dropout_rate': 0.3,
     'batch_size': 32,
-    'epochs': 100,
-    'learning_rate': 0.001,
+    'epochs': 1000,  # budget scaled with the 10x-smaller QAT learning rate
+    'learning_rate': 0.0001,  # QAT needs a smaller learning rate than FP32 training
     'validation_split': 0.2,
-    'model_save_path': 'models/intent_classifier.h5',
+    'model_save_path': 'models/intent_classifier',
     'tokenizer_save_path': 'models/tokenizer.json',
     'label_encoder_save_path': 'models/label_encoder.json'
 }
 
+# Sample intent data - replace with your actual dataset
+TEXTS: Final[tuple[str, ...]] = (
+    # Weather queries
+    "What's the weather like?",
+    "How's the weather today?",
+    "Is it going to rain?",
+    "What's the temperature?",
+    "Will it be sunny tomorrow?",
+    "Check the weather forecast",
+    "Is it cold outside?",
+    "What's the weather forecast for this week?",
+
+    # Time queries
+    "What time is it?",
+    "Tell me the current time",
+    "What's the time now?",
+    "Show me the clock",
+    "What time is it in New York?",
+    "Current time please",
+
+    # Greetings
+    "Hello",
+    "Hi there",
+    "Good morning",
+    "Good evening",
+    "Hey",
+    "How are you?",
+    "Nice to meet you",
+    "Greetings",
+
+    # Music queries
+    "Play some music",
+    "Play my favorite song",
+    "Turn on the radio",
+    "Play rock music",
+    "Start the music player",
+    "I want to listen to music",
+    "Play something upbeat",
+
+    # Calendar queries
+    "What's on my calendar?",
+    "Show me my schedule",
+    "Do I have any meetings today?",
+    "What's my next appointment?",
+    "Check my calendar",
+    "Schedule a meeting",
+
+    # News queries
+    "What's in the news?",
+    "Show me the latest news",
+    "Tell me about current events",
+    "What's happening in the world?",
+    "Read me the news",
+    "Any breaking news?",
+
+    # General queries
+    "Help me",
+    "What can you do?",
+    "Tell me a joke",
+    "How do I use this app?",
+    "What are your features?",
+    "Show me the menu",
+)
+
+# One label per text above, built per intent group to avoid transcription drift
+INTENTS: Final[tuple[str, ...]] = (
+    ('weather',) * 8
+    + ('time',) * 6
+    + ('greeting',) * 8
+    + ('music',) * 7
+    + ('calendar',) * 6
+    + ('news',) * 6
+    + ('help',) * 6
+)
+
 def load_data():
     """Load and prepare training data"""
-    # Sample intent data - replace with your actual dataset
-    data = {
-        'text': [
-            # Weather queries
-            "What's the weather like?",
-            "How's the weather today?",
-            "Is it going to rain?",
-            "What's the temperature?",
-            "Will it be sunny tomorrow?",
-            "Check the weather forecast",
-            "Is it cold outside?",
-            "What's the weather forecast for this week?",
-            
-            # Time queries
-            "What time is it?",
-            "Tell me the current time",
-            "What's the time now?",
-            "Show me the clock",
-            "What time is it in New York?",
-            "Current time please",
-            
-            # Greetings
-            "Hello",
-            "Hi there",
-            "Good morning",
-            "Good evening",
-            "Hey",
-            "How are you?",
-            "Nice to meet you",
-            "Greetings",
-            
-            # Music queries
-            "Play some music",
-            "Play my favorite song",
-            "Turn on the radio",
-            "Play rock music",
-            "Start the music player",
-            "I want to listen to music",
-            "Play something upbeat",
-            
-            # Calendar queries
-            "What's on my calendar?",
-            "Show me my schedule",
-            "Do I have any meetings today?",
-            "What's my next appointment?",
-            "Check my calendar",
-            "Schedule a meeting",
-            
-            # News queries
-            "What's in the news?",
-            "Show me the latest news",
-            "Tell me about current events",
-            "What's happening in the world?",
-            "Read me the news",
-            "Any breaking news?",
-            
-            # General queries
-            "Help me",
-            "What can you do?",
-            "Tell me a joke",
-            "How do I use this app?",
-            "What are your features?",
-            "Show me the menu",
-        ],
-        'intent': [
-            # Weather
-            'weather', 'weather', 'weather', 'weather', 'weather', 'weather', 'weather', 'weather',
-            # Time
-            'time', 'time', 'time', 'time', 'time', 'time',
-            # Greetings
-            'greeting', 'greeting', 'greeting', 'greeting', 'greeting', 'greeting', 'greeting', 'greeting',
-            # Music
-            'music', 'music', 'music', 'music', 'music', 'music', 'music',
-            # Calendar
-            'calendar', 'calendar', 'calendar', 'calendar', 'calendar', 'calendar',
-            # News
-            'news', 'news', 'news', 'news', 'news', 'news',
-            # General
-            'help', 'help', 'help', 'help', 'help', 'help',
-        ]
-    }
-    
-    return pd.DataFrame(data)
+    return pd.DataFrame({'text': TEXTS, 'intent': INTENTS})
+
+def create_graph_tokenizer(tokenizer):
+    """Build a graph-mode tokenizer from a fitted Keras tokenizer
+
+    Converts word_index into a tf.lookup.StaticHashTable so tokenization
+    runs as graph ops instead of a per-word Python dict loop. Mirrors the
+    Keras tokenizer's lowercasing and punctuation filtering; unknown words
+    map to the OOV index and sequences are padded/truncated post to
+    max_sequence_length.
+    """
+    oov_index = tokenizer.word_index[tokenizer.oov_token]
+    keys = tf.constant(list(tokenizer.word_index.keys()))
+    values = tf.constant(list(tokenizer.word_index.values()), dtype=tf.int32)
+    table = tf.lookup.StaticHashTable(
+        tf.lookup.KeyValueTensorInitializer(keys, values),
+        default_value=oov_index
+    )
+    filter_pattern = '[%s]' % re.escape(tokenizer.filters)
+
+    @tf.function
+    def tokenize(texts):
+        texts = tf.strings.lower(texts)
+        texts = tf.strings.regex_replace(texts, filter_pattern, ' ')
+        tokens = tf.strings.split(texts)
+        sequences = table.lookup(tokens)
+        if tokenizer.num_words:
+            # Match texts_to_sequences: words indexed past the vocab cap
+            # collapse to OOV instead of overrunning the embedding table
+            sequences = tf.ragged.map_flat_values(
+                lambda ids: tf.where(ids < tokenizer.num_words, ids, oov_index),
+                sequences
+            )
+        return sequences.to_tensor(
+            shape=[None, CONFIG['max_sequence_length']]
+        )
+
+    return tokenize
 
 def preprocess_data(df):
     """Preprocess text data and encode labels"""
@@ -126,69 +158,121 @@ def preprocess_data(df):
         num_words=CONFIG['max_vocab_size'],
         oov_token='<OOV>'
     )
-    
+
     # Fit tokenizer on texts
     tokenizer.fit_on_texts(df['text'])
-    
-    # Convert texts to sequences
-    sequences = tokenizer.texts_to_sequences(df['text'])
-    
-    # Pad sequences
-    X = pad_sequences(
-        sequences,
-        maxlen=CONFIG['max_sequence_length'],
-        padding='post',
-        truncating='post'
-    )
-    
-    # Encode labels
-    label_encoder = LabelEncoder()
-    y = label_encoder.fit_transform(df['intent'])
-    
-    # Convert to categorical
-    y = tf.keras.utils.to_categorical(y, num_classes=len(label_encoder.classes_))
-    
-    return X, y, tokenizer, label_encoder
+
+    # Tokenize and pad in graph mode
+    tokenize = create_graph_tokenizer(tokenizer)
+    X = tokenize(tf.constant(df['text'])).numpy()
+
+    # Encode labels and one-hot in a single vectorized pass
+    codes, class_names = pd.factorize(df['intent'], sort=True)
+    y = np.eye(len(class_names), dtype=np.float32)[codes]
+
+    return X, y, tokenizer, class_names
+
+class MaskedAveragePooling1D(Layer):
+    """Average embeddings over non-padded tokens only.
+
+    Fuses the embedding average into a single masked reduce-sum-then-scale
+    (the EmbeddingBag mean pattern), so padded positions neither dilute the
+    average nor cost memory bandwidth in the [batch, seq, dim] intermediate.
+    """
+    def call(self, inputs):
+        embeddings, token_ids = inputs
+        mask = tf.cast(tf.not_equal(token_ids, 0), embeddings.dtype)
+        summed = tf.reduce_sum(embeddings * tf.expand_dims(mask, -1), axis=1)
+        lengths = tf.maximum(tf.reduce_sum(mask, axis=1, keepdims=True), 1.0)
+        return summed / lengths
+
+class PerChannelDenseQuantizeConfig(tfmot.quantization.keras.QuantizeConfig):
+    """Quantize Dense kernels with one scale per output channel
+
+    tfmot's default 8-bit registry quantizes Dense weights per-tensor, so
+    the converter would emit a single scalar scale per kernel; a per-axis
+    weight quantizer keeps the FakeQuant ranges per output unit, which the
+    INT8 export verifies.
+    """
+    def get_weights_and_quantizers(self, layer):
+        return [(layer.kernel, tfmot.quantization.keras.quantizers.LastValueQuantizer(
+            num_bits=8, per_axis=True, symmetric=True, narrow_range=True
+        ))]
+
+    def get_activations_and_quantizers(self, layer):
+        return [(layer.activation, tfmot.quantization.keras.quantizers.MovingAverageQuantizer(
+            num_bits=8, per_axis=False, symmetric=False, narrow_range=False
+        ))]
+
+    def set_quantize_weights(self, layer, quantize_weights):
+        layer.kernel = quantize_weights[0]
+
+    def set_quantize_activations(self, layer, quantize_activations):
+        layer.activation = quantize_activations[0]
+
+    def get_output_quantizers(self, layer):
+        return []
+
+    def get_config(self):
+        return {}
 
 def create_model(vocab_size, num_classes):
     """Create the intent classification model"""
+    # Annotate the Dense layers for quantization with per-channel kernels;
+    # the custom pooling layer stays unannotated (it has no weights to
+    # quantize)
+    def quantize_annotate_layer(layer):
+        return tfmot.quantization.keras.quantize_annotate_layer(
+            layer, quantize_config=PerChannelDenseQuantizeConfig()
+        )
+
     # Input layer
     input_layer = Input(shape=(CONFIG['max_sequence_length'],))
-    
-    # Embedding layer
+
+    # Embedding layer - left unannotated because tfmot's default 8-bit
+    # registry does not support Embedding; its weights are quantized
+    # post-training via the representative dataset instead
     embedding = Embedding(
         vocab_size,
         CONFIG['embedding_dim'],
         input_length=CONFIG['max_sequence_length']
     )(input_layer)
-    
-    # Global average pooling
-    pooling = GlobalAveragePooling1D()(embedding)
-    
+
+    # Masked average pooling over non-padded tokens
+    pooling = MaskedAveragePooling1D()([embedding, input_layer])
+
     # Dense layers
-    dense1 = Dense(
+    dense1 = quantize_annotate_layer(Dense(
         CONFIG['hidden_units'],
         activation='relu'
-    )(pooling)
-    
+    ))(pooling)
+
     dropout1 = Dropout(CONFIG['dropout_rate'])(dense1)
-    
-    dense2 = Dense(
+
+    dense2 = quantize_annotate_layer(Dense(
         CONFIG['hidden_units'] // 2,
         activation='relu'
-    )(dropout1)
-    
+    ))(dropout1)
+
     dropout2 = Dropout(CONFIG['dropout_rate'])(dense2)
-    
+
     # Output layer
-    output = Dense(
+    output = quantize_annotate_layer(Dense(
         num_classes,
         activation='softmax'
-    )(dropout2)
-    
+    ))(dropout2)
+
     # Create model
     model = Model(inputs=input_layer, outputs=output)
-    
+
+    # Apply quantization-aware training so weights and activations
+    # learn INT8-robust parameters before TFLite export
+    with tfmot.quantization.keras.quantize_scope({
+        'MaskedAveragePooling1D': MaskedAveragePooling1D,
+        'PerChannelDenseQuantizeConfig': PerChannelDenseQuantizeConfig
+    }):
+        model = tfmot.quantization.keras.quantize_apply(model)
+
     # Compile model
     model.compile(
         optimizer=Adam(learning_rate=CONFIG['learning_rate']),
@@ -200,6 +284,10 @@ def create_model(vocab_size, num_classes):
 
 def train_model():
     """Main training function"""
+    # Fix seeds and op determinism so runs are reproducible
+    tf.keras.utils.set_random_seed(42)
+    tf.config.experimental.enable_op_determinism()
+
     # Create directories
     os.makedirs('models', exist_ok=True)
     
@@ -210,11 +298,13 @@ def train_model():
     
     # Preprocess data
     print("Preprocessing data...")
-    X, y, tokenizer, label_encoder = preprocess_data(df)
+    X, y, tokenizer, class_names = preprocess_data(df)
     
     # Split data
+    # Stratify so the small validation fold still covers every intent
     X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=CONFIG['validation_split'], random_state=42
+        X, y, test_size=CONFIG['validation_split'], random_state=42,
+        stratify=df['intent']
     )
     
     print(f"Training samples: {len(X_train)}")
@@ -223,7 +313,7 @@ def train_model():
     # Create model
     print("Creating model...")
     vocab_size = min(len(tokenizer.word_index) + 1, CONFIG['max_vocab_size'])
-    num_classes = len(label_encoder.classes_)
+    num_classes = len(class_names)
     
     model = create_model(vocab_size, num_classes)
     model.summary()
@@ -232,51 +322,69 @@ def train_model():
     callbacks = [
         EarlyStopping(
             monitor='val_loss',
-            patience=10,
+            patience=50,
             restore_best_weights=True
         ),
         ModelCheckpoint(
             CONFIG['model_save_path'],
             monitor='val_accuracy',
-            save_best_only=True,
-            save_weights_only=False
+            save_best_only=True
         ),
         ReduceLROnPlateau(
             monitor='val_loss',
             factor=0.5,
-            patience=5,
+            patience=20,
             min_lr=1e-6
         )
     ]
     
+    # Build tf.data pipelines - cache avoids re-copying the arrays every
+    # epoch and prefetch overlaps input preparation with compute
+    train_dataset = (
+        tf.data.Dataset.from_tensor_slices((X_train, y_train))
+        .cache()
+        .shuffle(len(X_train))
+        .batch(CONFIG['batch_size'])
+        .prefetch(tf.data.AUTOTUNE)
+    )
+    val_dataset = (
+        tf.data.Dataset.from_tensor_slices((X_val, y_val))
+        .batch(CONFIG['batch_size'])
+        .cache()
+    )
+
     # Train model
     print("Training model...")
     history = model.fit(
-        X_train, y_train,
-        batch_size=CONFIG['batch_size'],
+        train_dataset,
         epochs=CONFIG['epochs'],
-        validation_data=(X_val, y_val),
+        validation_data=val_dataset,
         callbacks=callbacks,
         verbose=1
     )
     
-    # Save tokenizer
+    # Save tokenizer as a flat dict - to_json() nests an escaped JSON
+    # string that needs a double parse on load
     print("Saving tokenizer...")
-    tokenizer_json = tokenizer.to_json()
+    tokenizer_data = {
+        'word_index': tokenizer.word_index,
+        'oov_token': tokenizer.oov_token,
+        'num_words': tokenizer.num_words
+    }
     with open(CONFIG['tokenizer_save_path'], 'w') as f:
-        f.write(tokenizer_json)
+        json.dump(tokenizer_data, f)
     
     # Save label encoder
     print("Saving label encoder...")
     label_encoder_data = {
-        'classes': label_encoder.classes_.tolist()
+        'classes': class_names.tolist()
     }
     with open(CONFIG['label_encoder_save_path'], 'w') as f:
         json.dump(label_encoder_data, f)
     
     # Evaluate model
     print("Evaluating model...")
-    val_loss, val_accuracy = model.evaluate(X_val, y_val, verbose=0)
+    val_loss, val_accuracy = model.evaluate(val_dataset, verbose=0)
     print(f"Validation Loss: {val_loss:.4f}")
     print(f"Validation Accuracy: {val_accuracy:.4f}")
     